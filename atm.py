@@ -12,126 +12,433 @@ Features:
 import json
 import os
 import hashlib
+import hmac
 import secrets
 import getpass
 import time
 import sys
+import atexit
+import mmap
+
+try:
+    import orjson
+except ImportError:  # optional, stdlib json is used otherwise
+    orjson = None
 
 DB_FILE = "db.json"
+TX_FILE = "transactions.jsonl"
+DEBUG = bool(os.environ.get("DEBUG"))
+# balances and atm_cash are space-padded to this many bytes in db.json so
+# they can be overwritten in place (JSON allows whitespace after a number).
+# Trade-off: an in-place patch is two separate writes into the live file and
+# skips the temp-file-and-rename in save_db, so a crash between them can
+# leave a balance and atm_cash that are each valid but don't agree.
+# transactions.jsonl (fsynced first) is the record to reconcile from.
+NUM_WIDTH = 15
+
+# scrypt cost: 2**14 * 8 * 128 bytes = 16 MiB of memory per hash
+SCRYPT_N = 2 ** 14
+SCRYPT_R = 8
+SCRYPT_P = 1
+PIN_CACHE_TTL = 300  # seconds a login keeps its PIN check cached
+
+# username -> (pin_hash, session token, monotonic expiry), filled by authenticate
+_verified = {}
+_SESSION_KEY = secrets.token_bytes(32)
+# TX_FILE kept open for appending, see _tx_file
+_tx_fp = None
+
+# pin_salt -> sha256 already fed with that salt, for legacy hashes
+_salt_ctx = {}
+
+class DB(dict):
+    """DB dict that defers writes: mutations set _dirty, save happens on exit."""
+    _dirty = False
+    _patched = False
+    # byte offsets of the padded numbers in db.json, set by save_db
+    _cash_offset = None
+    _bal_offsets = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.flush()
+        return False
+
+    def flush(self):
+        if self._dirty or self._patched:
+            # commit the log first so it is never behind the balances
+            _flush_tx(commit=True)
+        if self._dirty:
+            save_db(self, commit=True)
+            self._dirty = False
+            self._patched = False
+        elif self._patched:
+            # writable handle: Windows refuses to fsync a read-only one
+            with open(DB_FILE, "r+b") as f:
+                os.fsync(f.fileno())
+            self._patched = False
+
+    def patch_balance(self, username, user):
+        # a deposit/withdraw only changes two numbers; overwrite those bytes
+        # in db.json instead of rewriting it, when the last save indexed them
+        if self._dirty:
+            return  # a full save is coming anyway
+        offset = self._bal_offsets.get(username)
+        balance = _pad_num(user["balance"])
+        cash = _pad_num(self["atm_cash"])
+        if offset is None or self._cash_offset is None or balance is None or cash is None:
+            self._dirty = True
+            return
+        # the caller has already logged the change; make it durable before
+        # touching db.json so the log can't trail the balances on disk
+        _flush_tx(commit=True)
+        with open(DB_FILE, "r+b") as f:
+            f.seek(offset)
+            f.write(balance)
+            f.seek(self._cash_offset)
+            f.write(cash)
+        self._patched = True
 
 def load_db():
-    if not os.path.exists(DB_FILE):
-        new_db = {"atm_cash": 10000, "users": {}, "transactions": []}
+    try:
+        new_db = DB(_load_file(DB_FILE))
+    except FileNotFoundError:
+        new_db = DB({"atm_cash": to_cents(10000), "users": {}, "cents": True})
         save_db(new_db)
-        return new_db
-    with open(DB_FILE, "r") as f:
-        return json.load(f)
+    else:
+        changed = False
+        # older db.json files store money as float dollars
+        if not new_db.get("cents"):
+            new_db["atm_cash"] = to_cents(new_db["atm_cash"])
+            for user in new_db["users"].values():
+                user["balance"] = to_cents(user["balance"])
+            new_db["cents"] = True
+            changed = True
+        # they also keep the history inline (in dollars); move it to TX_FILE
+        old_txs = new_db.pop("transactions", None)
+        if old_txs is not None:
+            for tx in old_txs:
+                tx["amount"] = to_cents(tx["amount"])
+            lines = [_dumps_line(tx) for tx in old_txs]
+            # a crash before the save below leaves the history in both files;
+            # don't append it a second time on the next start
+            try:
+                tail = _tail_lines(TX_FILE, len(lines))
+                done = tail == [line.rstrip(b"\n") for line in lines]
+            except FileNotFoundError:
+                done = False
+            if not done:
+                _tx_file().write(b"".join(lines))
+                # the history must be on disk before db.json stops holding it
+                _flush_tx(commit=True)
+            changed = True
+        if changed:
+            save_db(new_db, commit=True)
+        for user in new_db["users"].values():
+            if user.get("pin_salt"):
+                _salt_ctx[user["pin_salt"]] = hashlib.sha256(user["pin_salt"].encode())
+    atexit.register(new_db.flush)
+    return new_db
+
+def _loads(data):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def _load_file(path):
+    # map the file instead of read()ing it into a bytes object first;
+    # orjson parses straight from the mapping, stdlib json needs one copy
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if os.fstat(fd).st_size == 0:
+            return _loads(b"")  # mmap refuses empty files; raise the parse error
+        with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mm:
+            if orjson is not None:
+                with memoryview(mm) as mv:
+                    return orjson.loads(mv)
+            return json.loads(mm[:])
+    finally:
+        os.close(fd)
+
+def _dumps(obj):
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if DEBUG else 0)
+    if DEBUG:
+        return json.dumps(obj, indent=2).encode()
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+def _dumps_line(obj):
+    # one compact JSON line, regardless of DEBUG
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return json.dumps(obj, separators=(",", ":")).encode() + b"\n"
+
+def _pad_num(n):
+    # None if n can't be written in place (not int cents, or too wide)
+    if type(n) is not int:
+        return None
+    data = str(n).encode()
+    if len(data) > NUM_WIDTH:
+        return None
+    return data.ljust(NUM_WIDTH)
+
+def _dumps_indexed(db):
+    # compact JSON like _dumps, but with atm_cash and every balance padded
+    # to NUM_WIDTH; returns the bytes and the offsets of those numbers
+    out = bytearray(b"{")
+    cash_offset = None
+    bal_offsets = {}
+    for i, (key, value) in enumerate(db.items()):
+        if i:
+            out += b","
+        out += _dumps(key) + b":"
+        padded = _pad_num(value) if key == "atm_cash" else None
+        if padded is not None:
+            cash_offset = len(out)
+            out += padded
+        elif key == "users":
+            out += b"{"
+            for j, (username, user) in enumerate(value.items()):
+                if j:
+                    out += b","
+                out += _dumps(username) + b":"
+                rest = {k: v for k, v in user.items() if k != "balance"}
+                out += _dumps(rest)[:-1]
+                if "balance" in user:
+                    out += b',"balance":' if rest else b'"balance":'
+                    padded = _pad_num(user["balance"])
+                    if padded is None:
+                        out += _dumps(user["balance"])
+                    else:
+                        bal_offsets[username] = len(out)
+                        out += padded
+                out += b"}"
+            out += b"}"
+        else:
+            out += _dumps(value)
+    out += b"}"
+    return bytes(out), cash_offset, bal_offsets
 
-def save_db(db):
-    with open(DB_FILE, "w") as f:
-        json.dump(db, f, indent=2)
+def _fsync_dir(path):
+    # make the rename itself durable; Windows can't open a directory for
+    # fsync (NTFS journals the rename anyway)
+    if os.name == "nt":
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def save_db(db, commit=False):
+    # one write of a pre-built buffer; json.dump would issue a write per token.
+    # Written to a temp file and renamed over DB_FILE so a crash never leaves
+    # a half-written db.json; fsync only when committing an operation.
+    if DEBUG:
+        data, cash_offset, bal_offsets = _dumps(db), None, {}
+    else:
+        data, cash_offset, bal_offsets = _dumps_indexed(db)
+    tmp = DB_FILE + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        if commit:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp, DB_FILE)
+    if commit:
+        _fsync_dir(DB_FILE)
+    db._cash_offset = cash_offset
+    db._bal_offsets = bal_offsets
+
+# money is kept as integer cents; convert only when reading input / printing
+
+def to_cents(x):
+    cents = float(x) * 100
+    # also rejects inf/nan; orjson can't store ints wider than 64 bits
+    if not -2 ** 63 < cents < 2 ** 63:
+        raise ValueError("bad amount")
+    return int(round(cents))
+
+def fmt_cents(cents):
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
+def hash_pin(pin):
+    # salt and cost are stored in the hash string itself
+    salt = secrets.token_bytes(16)
+    key = hashlib.scrypt(pin.encode(), salt=salt, n=SCRYPT_N, r=SCRYPT_R, p=SCRYPT_P)
+    return f"scrypt${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${salt.hex()}${key.hex()}"
+
+def verify_pin(pin, pin_hash, salt=None):
+    if pin_hash.startswith("scrypt$"):
+        _, n, r, p, salt_hex, key_hex = pin_hash.split("$")
+        key = hashlib.scrypt(pin.encode(), salt=bytes.fromhex(salt_hex),
+                             n=int(n), r=int(r), p=int(p))
+        return hmac.compare_digest(key, bytes.fromhex(key_hex))
+    # legacy records: single sha256 over salt + pin, salt kept in pin_salt
+    ctx = _salt_ctx.get(salt)
+    if ctx is None:
+        ctx = _salt_ctx[salt] = hashlib.sha256(salt.encode())
+    h = ctx.copy()
+    h.update(pin.encode())
+    digest = h.digest()
+    return hmac.compare_digest(digest, bytes.fromhex(pin_hash))
+
+def set_pin(user, pin):
+    user["pin_hash"] = hash_pin(pin)
+    _salt_ctx.pop(user.pop("pin_salt", None), None)
 
-def hash_pin(pin, salt=None):
-    if salt is None:
-        salt = secrets.token_hex(8)
-    pin_hash = hashlib.sha256((salt + pin).encode()).hexdigest()
-    return salt, pin_hash
+def _session_token(pin):
+    return hmac.new(_SESSION_KEY, pin.encode(), hashlib.sha256).digest()
 
-def verify_pin(pin, salt, pin_hash):
-    return hashlib.sha256((salt + pin).encode()).hexdigest() == pin_hash
+def check_user_pin(username, user, pin):
+    # after a login the PIN is checked against a cheap keyed hash instead
+    # of re-running scrypt, as long as the stored hash hasn't changed
+    cached = _verified.get(username)
+    if cached and cached[0] == user["pin_hash"] and time.monotonic() < cached[2]:
+        return hmac.compare_digest(cached[1], _session_token(pin))
+    return verify_pin(pin, user["pin_hash"], user.get("pin_salt"))
 
 def log_transaction(db, username, action_type, amount, note=""):
     entry = {
-        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "time": int(time.time()),  # epoch seconds, formatted when viewed
         "user": username,
         "type": action_type,
         "amount": amount,
         "note": note
     }
-    db["transactions"].append(entry)
-    save_db(db)
+    # append-only and buffered: db.json is not rewritten, and the log file
+    # is only written when its 64 KiB buffer fills or an operation commits
+    _tx_file().write(_dumps_line(entry))
+
+def _tx_file():
+    global _tx_fp
+    if _tx_fp is None:
+        _tx_fp = open(TX_FILE, "ab", buffering=64 * 1024)
+    return _tx_fp
+
+def _flush_tx(commit=False):
+    if _tx_fp is None or _tx_fp.closed:
+        return
+    _tx_fp.flush()
+    if commit:
+        os.fsync(_tx_fp.fileno())
+
+def _close_tx():
+    if _tx_fp is not None:
+        _tx_fp.close()
+
+# registered at import, so it runs after the DB.flush hooks load_db adds
+# (atexit is LIFO) and the log is still open while they commit
+atexit.register(_close_tx)
 
 def create_user(db, username, pin=None, role="user", balance=0):
     if username in db["users"]:
         raise ValueError("user exists")
     
-    salt, pin_hash = (None, None)
+    pin_hash = None
     if pin is not None:
-        salt, pin_hash = hash_pin(pin)
+        pin_hash = hash_pin(pin)
     
     db["users"][username] = {
         "role": role,
-        "pin_salt": salt,
         "pin_hash": pin_hash,
-        "balance": float(balance)
+        "balance": int(balance)
     }
-    save_db(db)
+    db._dirty = True
     log_transaction(db, username, "create_user", balance, f"role={role}")
 
 def delete_user(db, username):
     if username not in db["users"]:
         raise ValueError("no user")
     del db["users"][username]
-    save_db(db)
+    db._dirty = True
     log_transaction(db, username, "delete_user", 0, "deleted")
 
 def change_pin(db, username, old_pin, new_pin):
     user = db["users"].get(username)
     if not user:
         raise ValueError("no user")
-    if user["pin_hash"] and not verify_pin(old_pin, user["pin_salt"], user["pin_hash"]):
+    if user["pin_hash"] and not check_user_pin(username, user, old_pin):
         raise ValueError("wrong pin")
-    salt, pin_hash = hash_pin(new_pin)
-    user["pin_salt"] = salt
-    user["pin_hash"] = pin_hash
-    save_db(db)
+    set_pin(user, new_pin)
+    _verified.pop(username, None)
+    db._dirty = True
     log_transaction(db, username, "change_pin", 0, "")
 
-def check_balance(db, username):
-    user = db["users"].get(username)
-    if not user:
-        raise ValueError("no user")
+# check_balance/deposit/withdraw take the user record itself; callers
+# look it up once (see main) so these skip the db["users"] probe
+
+def check_balance(db, user):
     return user["balance"]
 
-def deposit(db, username, amount):
+def deposit(db, username, user, amount):
     if amount <= 0:
         raise ValueError("bad amount")
-    user = db["users"].get(username)
-    if not user:
-        raise ValueError("no user")
     user["balance"] += amount
     db["atm_cash"] += amount
-    save_db(db)
     log_transaction(db, username, "deposit", amount, "")
+    db.patch_balance(username, user)
 
-def withdraw(db, username, amount):
+def withdraw(db, username, user, amount):
     if amount <= 0:
         raise ValueError("bad amount")
-    user = db["users"].get(username)
-    if not user:
-        raise ValueError("no user")
     if user["balance"] < amount:
         raise ValueError("insufficient funds")
     if db["atm_cash"] < amount:
         raise ValueError("ATM out of cash")
     user["balance"] -= amount
     db["atm_cash"] -= amount
-    save_db(db)
     log_transaction(db, username, "withdraw", amount, "")
+    db.patch_balance(username, user)
     return True
 
 def list_users(db):
-    summary = {}
+    return {u: {"role": i["role"], "balance": i["balance"]} for u, i in db["users"].items()}
+
+def iter_users(db):
     for username, info in db["users"].items():
-        summary[username] = {"role": info["role"], "balance": info["balance"]}
-    return summary
+        yield username, info["role"], info["balance"]
+
+def _tail_lines(path, n, block=4096):
+    # read backwards from the end one block at a time until we've seen
+    # n + 1 newlines (or hit the start), so only the tail is read
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        buf = b""
+        while pos > 0 and buf.count(b"\n") <= n:
+            step = min(block, pos)
+            pos -= step
+            f.seek(pos)
+            buf = f.read(step) + buf
+    lines = buf.splitlines()
+    if pos > 0:
+        lines = lines[1:]  # first line may be cut in half
+    return lines[-n:] if n > 0 else []
 
 def view_transactions(db, limit=20):
-    return db["transactions"][-limit:]
+    _flush_tx()
+    try:
+        lines = _tail_lines(TX_FILE, limit)
+    except FileNotFoundError:
+        return []
+    txs = [json.loads(line) for line in lines]
+    for tx in txs:
+        tx["amount_str"] = fmt_cents(tx["amount"])
+        t = tx["time"]
+        # entries migrated from older db.json files already hold a string
+        if isinstance(t, str):
+            tx["time_str"] = t
+        else:
+            tx["time_str"] = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(t))
+    return txs
 
 def set_atm_cash(db, amount):
-    db["atm_cash"] = float(amount)
-    save_db(db)
+    db["atm_cash"] = int(amount)
+    db._dirty = True
     log_transaction(db, "admin", "set_atm_cash", amount, "")
 
 def change_role(db, username, new_role):
@@ -139,11 +446,10 @@ def change_role(db, username, new_role):
         raise ValueError("no such user")
     old_role = db["users"][username]["role"]
     db["users"][username]["role"] = new_role
-    save_db(db)
+    db._dirty = True
     log_transaction(db, "admin", "change_role", 0, f"{username}: {old_role} -> {new_role}")
 
-def first_time_login(db, username):
-    user = db["users"][username]
+def first_time_login(db, username, user):
     if user["pin_hash"]:
         return
     print(f"Welcome {username}, please create your PIN:")
@@ -153,103 +459,170 @@ def first_time_login(db, username):
         if pin != pin2:
             print("PINs do not match! Try again.")
             continue
-        salt, pin_hash = hash_pin(pin)
-        user["pin_salt"] = salt
-        user["pin_hash"] = pin_hash
-        save_db(db)
+        set_pin(user, pin)
+        db._dirty = True
         log_transaction(db, username, "set_pin", 0, "first-time setup")
         print("PIN created successfully!")
         break
 
-def authenticate(db, username):
-    if username not in db["users"]:
-        print("no user")
-        return False
-    first_time_login(db, username)
-    user = db["users"][username]
+def authenticate(db, username, user):
+    # precondition: user is db["users"][username], looked up by the caller
+    first_time_login(db, username, user)
     pin = input("PIN: ")
-    if verify_pin(pin, user["pin_salt"], user["pin_hash"]):
+    if verify_pin(pin, user["pin_hash"], user.get("pin_salt")):
+        if not user["pin_hash"].startswith("scrypt$"):
+            # upgrade legacy sha256 hashes now that we have the plain PIN
+            set_pin(user, pin)
+            db._dirty = True
+        _verified[username] = (user["pin_hash"], _session_token(pin),
+                               time.monotonic() + PIN_CACHE_TTL)
         return True
     print("wrong pin")
     return False
 
+# menus are written in one go instead of one print() per line
+_ADMIN_MENU = (
+    "\nADMIN MENU\n"
+    "1) list users\n"
+    "2) create user\n"
+    "3) delete user\n"
+    "4) view transactions\n"
+    "5) set ATM cash\n"
+    "6) change user role\n"
+    "7) exit\n"
+    "choice: "
+)
+_USER_MENU = (
+    "\nUSER MENU - {username}\n"
+    "1) balance\n"
+    "2) withdraw\n"
+    "3) deposit\n"
+    "4) change pin\n"
+    "5) exit\n"
+    "choice: "
+)
+_ADMIN_MENU_BYTES = _ADMIN_MENU.encode()
+
+def _write_menu(data):
+    # write pre-encoded bytes under the text layer; flush it first so
+    # anything print()ed before stays in order
+    sys.stdout.flush()
+    out = getattr(sys.stdout, "buffer", None)
+    if out is None:  # stdout replaced by a text-only stream
+        sys.stdout.write(data.decode())
+        sys.stdout.flush()
+        return
+    out.write(data)
+    out.flush()
+
+# menu handlers: one function per choice, looked up in the dicts below
+
+def _admin_list_users(db, admin_username):
+    for u, role, balance in iter_users(db):
+        print(f"{u}: {role}, {fmt_cents(balance)}")
+
+def _admin_create_user(db, admin_username):
+    username = input("username: ")
+    role = input("role (user): ") or "user"
+    balance = to_cents(input("balance (0): ") or 0)
+    create_user(db, username, pin=None, role=role, balance=balance)
+    print("user created; they must set PIN on first login")
+
+def _admin_delete_user(db, admin_username):
+    username = input("username: ")
+    confirm = input("delete? (yes): ")
+    if confirm.lower() == "yes":
+        delete_user(db, username)
+        print("deleted")
+
+def _admin_view_transactions(db, admin_username):
+    for tx in view_transactions(db):
+        line = f"{tx['time_str']}  {tx['user']}  {tx['type']}  {tx['amount_str']}"
+        if tx["note"]:
+            line += f"  ({tx['note']})"
+        print(line)
+
+def _admin_set_atm_cash(db, admin_username):
+    amount = to_cents(input("ATM cash: "))
+    set_atm_cash(db, amount)
+    print("done")
+
+def _admin_change_role(db, admin_username):
+    username = input("username: ")
+    new_role = input("new role: ")
+    change_role(db, username, new_role)
+    print(f"{username} role updated")
+
+_ADMIN_HANDLERS = {
+    "1": _admin_list_users,
+    "2": _admin_create_user,
+    "3": _admin_delete_user,
+    "4": _admin_view_transactions,
+    "5": _admin_set_atm_cash,
+    "6": _admin_change_role,
+}
+
+def _user_balance(db, username, user):
+    print(f"Balance: {fmt_cents(check_balance(db, user))}")
+
+def _user_withdraw(db, username, user):
+    amount = to_cents(input("amount: "))
+    withdraw(db, username, user, amount)
+    print("done")
+
+def _user_deposit(db, username, user):
+    amount = to_cents(input("amount: "))
+    deposit(db, username, user, amount)
+    print("done")
+
+def _user_change_pin(db, username, user):
+    old_pin = input("old PIN: ")
+    new_pin = input("new PIN: ")
+    change_pin(db, username, old_pin, new_pin)
+    print("done")
+
+_USER_HANDLERS = {
+    "1": _user_balance,
+    "2": _user_withdraw,
+    "3": _user_deposit,
+    "4": _user_change_pin,
+}
+
 def admin_menu(db, admin_username):
     while True:
-        print("\nADMIN MENU")
-        print("1) list users")
-        print("2) create user")
-        print("3) delete user")
-        print("4) view transactions")
-        print("5) set ATM cash")
-        print("6) change user role")
-        print("7) exit")
-        choice = input("choice: ")
+        _write_menu(_ADMIN_MENU_BYTES)
+        choice = input()
+        if choice == "7":
+            break
+        handler = _ADMIN_HANDLERS.get(choice)
+        if handler is None:
+            print("bad choice")
+            continue
+        # the try wraps the with so a failing save in __exit__ is reported too
         try:
-            if choice == "1":
-                for u, info in list_users(db).items():
-                    print(f"{u}: {info['role']}, {info['balance']}")
-            elif choice == "2":
-                username = input("username: ")
-                role = input("role (user): ") or "user"
-                balance = float(input("balance (0): ") or 0)
-                create_user(db, username, pin=None, role=role, balance=balance)
-                print("user created; they must set PIN on first login")
-            elif choice == "3":
-                username = input("username: ")
-                confirm = input("delete? (yes): ")
-                if confirm.lower() == "yes":
-                    delete_user(db, username)
-                    print("deleted")
-            elif choice == "4":
-                for tx in view_transactions(db):
-                    print(tx)
-            elif choice == "5":
-                amount = float(input("ATM cash: "))
-                set_atm_cash(db, amount)
-                print("done")
-            elif choice == "6":
-                username = input("username: ")
-                new_role = input("new role: ")
-                change_role(db, username, new_role)
-                print(f"{username} role updated")
-            elif choice == "7":
-                break
-            else:
-                print("bad choice")
+            with db:
+                handler(db, admin_username)
         except Exception as e:
             print("error:", e)
+    _flush_tx()
 
-def user_menu(db, username):
+def user_menu(db, username, user):
+    menu = _USER_MENU.format(username=username).encode()
     while True:
-        print(f"\nUSER MENU - {username}")
-        print("1) balance")
-        print("2) withdraw")
-        print("3) deposit")
-        print("4) change pin")
-        print("5) exit")
-        choice = input("choice: ")
+        _write_menu(menu)
+        choice = input()
+        if choice == "5":
+            break
+        handler = _USER_HANDLERS.get(choice)
+        if handler is None:
+            print("bad choice")
+            continue
         try:
-            if choice == "1":
-                print(f"Balance: {check_balance(db, username)}")
-            elif choice == "2":
-                amount = float(input("amount: "))
-                withdraw(db, username, amount)
-                print("done")
-            elif choice == "3":
-                amount = float(input("amount: "))
-                deposit(db, username, amount)
-                print("done")
-            elif choice == "4":
-                old_pin = input("old PIN: ")
-                new_pin = input("new PIN: ")
-                change_pin(db, username, old_pin, new_pin)
-                print("done")
-            elif choice == "5":
-                break
-            else:
-                print("bad choice")
+            with db:
+                handler(db, username, user)
         except Exception as e:
             print("error:", e)
+    _flush_tx()
 
 def ensure_admin(db):
     for u, info in db["users"].items():
@@ -269,7 +642,8 @@ def ensure_admin(db):
 
 def main():
     db = load_db()
-    ensure_admin(db)
+    with db:
+        ensure_admin(db)
     print("ATM SYSTEM")
     while True:
         print("\n1) login")
@@ -277,16 +651,19 @@ def main():
         choice = input("choice: ")
         if choice == "1":
             username = input("username: ")
-            if username not in db["users"]:
+            user = db["users"].get(username)
+            if user is None:
                 print("no user")
                 continue
-            if not authenticate(db, username):
-                continue
-            role = db["users"][username]["role"]
+            with db:
+                if not authenticate(db, username, user):
+                    continue
+            # role is fixed for the session
+            role = user["role"]
             if role == "admin":
                 admin_menu(db, username)
             else:
-                user_menu(db, username)
+                user_menu(db, username, user)
         elif choice == "2":
             print("bye")
             sys.exit(0)
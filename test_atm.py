@@ -0,0 +1,74 @@
+import json
+import os
+import tempfile
+import unittest
+
+import atm
+
+
+class DumpsIndexedTest(unittest.TestCase):
+    def setUp(self):
+        self.db = atm.DB({
+            "atm_cash": 425300,
+            "users": {
+                "alice": {"role": "user", "pin_hash": None, "balance": 103000},
+                "bob": {"role": "admin", "pin_hash": None, "balance": 0},
+                "odd": {"balance": 5},
+            },
+            "cents": True,
+        })
+
+    def test_output_is_valid_json(self):
+        data, _, _ = atm._dumps_indexed(self.db)
+        self.assertEqual(json.loads(data), self.db)
+
+    def test_offsets_point_at_padded_numbers(self):
+        data, cash_offset, bal_offsets = atm._dumps_indexed(self.db)
+        field = data[cash_offset:cash_offset + atm.NUM_WIDTH]
+        self.assertEqual(field, b"425300".ljust(atm.NUM_WIDTH))
+        self.assertEqual(set(bal_offsets), {"alice", "bob", "odd"})
+        for username, offset in bal_offsets.items():
+            expected = str(self.db["users"][username]["balance"]).encode()
+            self.assertEqual(data[offset:offset + atm.NUM_WIDTH], expected.ljust(atm.NUM_WIDTH))
+
+    def test_unpaddable_numbers_are_not_indexed(self):
+        self.db["atm_cash"] = 10 ** atm.NUM_WIDTH
+        self.db["users"]["alice"]["balance"] = 1.5
+        data, cash_offset, bal_offsets = atm._dumps_indexed(self.db)
+        self.assertIsNone(cash_offset)
+        self.assertNotIn("alice", bal_offsets)
+        self.assertEqual(json.loads(data), self.db)
+
+
+class PatchBalanceTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.tmp = tempfile.TemporaryDirectory()
+        os.chdir(self.tmp.name)
+
+    def tearDown(self):
+        atm._flush_tx()
+        atm._close_tx()
+        atm._tx_fp = None
+        os.chdir(self.cwd)
+        self.tmp.cleanup()
+
+    def test_patch_matches_full_save(self):
+        db = atm.load_db()
+        with db:
+            atm.create_user(db, "alice", balance=1000)
+        user = db["users"]["alice"]
+        size = os.path.getsize(atm.DB_FILE)
+        with db:
+            atm.deposit(db, "alice", user, 2345)
+        with db:
+            atm.withdraw(db, "alice", user, 45)
+        self.assertEqual(os.path.getsize(atm.DB_FILE), size)
+        with open(atm.DB_FILE, "rb") as f:
+            on_disk = json.loads(f.read())
+        self.assertEqual(on_disk["users"]["alice"]["balance"], 3300)
+        self.assertEqual(on_disk["atm_cash"], db["atm_cash"])
+
+
+if __name__ == "__main__":
+    unittest.main()